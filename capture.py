@@ -1,32 +1,192 @@
 #!/usr/bin/env python3
 """
 Tapo Camera Image Capture Script
-Captures images from Tapo cameras and saves them in lossless formats.
+Captures images from Tapo cameras and saves them in lossless formats,
+or as JPEG/WebP when speed and file size matter more.
 Supports both RTSP stream capture and HTTP API methods.
 """
 
 import cv2
 import requests
-import base64
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    import pybase64 as base64  # SIMD-accelerated drop-in for the stdlib module
+except ImportError:
+    import base64
 import hashlib
+import binascii
 import time
 import os
 import sys
 import io
+import json
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 from urllib.parse import quote
 import argparse
 from PIL import Image
 import numpy as np
 
+# Leading bytes identifying the container formats we can write as-is
+IMAGE_SIGNATURES = (
+    (b"\x89PNG", "PNG"),
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+    (b"BM", "BMP"),
+)
+
+def sniff_image_format(data):
+    """Return the container format of encoded image bytes, or None if unknown"""
+    for signature, name in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return name
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+def open_for_overwrite(output_path):
+    """Open a file for writing from the start without truncating it first"""
+    # Unlike 'wb', 'r+b' does not free the file's blocks only to allocate
+    # them again (see --ring-size); callers truncate after writing
+    try:
+        return open(output_path, 'r+b')
+    except FileNotFoundError:
+        return open(output_path, 'wb')
+
+def write_image_bytes(output_path, data):
+    """Write encoded image bytes, overwriting an existing file in place"""
+    with open_for_overwrite(output_path) as f:
+        f.write(data)
+        f.truncate()
+
+# Lossy output formats and their encoder quality settings
+LOSSY_FORMATS = ("JPEG", "WEBP")
+JPEG_QUALITY = 95
+WEBP_QUALITY = 90
+
+# OpenCV JPEG settings; 4:4:4 chroma needs OpenCV >= 4.5.5
+JPEG_OPENCV_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+if hasattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR"):
+    JPEG_OPENCV_PARAMS += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444]
+
+def opencv_encoders(png_level):
+    """Per-format cv2.imencode (extension, params) for the given PNG level"""
+    # WebP is left to PIL: OpenCV's encoder cannot select libwebp's fastest method
+    return {
+        "PNG": (".png", [cv2.IMWRITE_PNG_COMPRESSION, png_level]),
+        "TIFF": (".tiff", [cv2.IMWRITE_TIFF_COMPRESSION, 1]),  # 1 = none
+        "BMP": (".bmp", []),
+        "JPEG": (".jpg", JPEG_OPENCV_PARAMS),
+    }
+
+def pil_savers(png_level):
+    """Per-format PIL save calls taking (img, path), for the given PNG level"""
+    return {
+        "PNG": lambda img, path: img.save(path, "PNG", compress_level=png_level,
+                                          optimize=False),
+        "TIFF": lambda img, path: img.save(path, "TIFF", compression=None),
+        "BMP": lambda img, path: img.save(path, "BMP"),
+        "JPEG": lambda img, path: img.save(path, "JPEG", quality=JPEG_QUALITY, optimize=False,
+                                           progressive=False, subsampling=0),  # 0 = 4:4:4
+        "WEBP": lambda img, path: img.save(path, "WEBP", quality=WEBP_QUALITY,
+                                           method=1),  # fastest
+    }
+
+# RTSP over TCP with a larger receive buffer avoids UDP setup jitter and
+# dropped packets; must be set before the first VideoCapture is created
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "rtsp_transport;tcp|buffer_size;1024000")
+RTSP_TIMEOUT_MSEC = 3000
+
+# How long a capture waits for the background reader to hand over a frame,
+# and how many failed grabs in a row mean the stream is lost
+RTSP_FRAME_TIMEOUT_SECONDS = 15
+RTSP_MAX_GRAB_FAILURES = 10
+
+# Login tokens are cached on disk so separate runs can skip the login request
+TOKEN_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "tapo_ai"
+)
+TOKEN_TTL_SECONDS = 3600
+TOKEN_EXPIRED_ERROR_CODE = -40401
+
 class TapoCamera:
-    def __init__(self, ip, username, password):
+    def __init__(self, ip, username, password, png_level=1, background_save=False):
         self.ip = ip
         self.username = username
         self.password = password
+        self.png_level = png_level  # zlib level 0-9; low levels trade size for speed
+        
+        # Save dispatch tables with this camera's settings bound in
+        self._cv_encoders = opencv_encoders(png_level)
+        self._pil_savers = pil_savers(png_level)
+        
+        # Login credentials never change, so encode them once
+        self._user_b64 = base64.b64encode(username.encode()).decode()
+        self._pw_hashed_b64 = base64.b64encode(
+            binascii.hexlify(hashlib.md5(password.encode()).digest())
+        ).decode()
         self.token = None
+        self.cap = None  # RTSP stream, opened lazily and reused across captures
+        self.rtsp_url = None  # URL that last produced a stream
+        self._reader = None  # thread that keeps grabbing from self.cap
+        
+        # Optional writer threads so encoding a frame overlaps reading the next
+        self._writer = None
+        if background_save:
+            self._writer = ThreadPoolExecutor(max_workers=2)
+            self._write_slots = threading.Semaphore(2)  # bound frames held in memory
+            self._pending_writes = {}  # output path -> future of its in-flight save
+            self._pending_lock = threading.Lock()
         self.session = requests.Session()
         
+        # Keep connections to the camera alive and retry transient gateway errors
+        retry = Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504],
+                      allowed_methods=None)  # also retry the API's POST requests
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4,
+                                                  max_retries=retry))
+        self.session.headers["Connection"] = "keep-alive"
+        self._load_cached_token()
+        
+    def _token_cache_path(self):
+        """Path of the on-disk token cache for this camera and these credentials"""
+        # Keyed by the credentials too, so a wrong password never reuses a token
+        # stored by another login
+        credentials = hashlib.sha256(f"{self._user_b64}:{self._pw_hashed_b64}".encode())
+        return os.path.join(TOKEN_CACHE_DIR, f"token_{self.ip}_{credentials.hexdigest()[:16]}.json")
+    
+    def _load_cached_token(self):
+        """Restore a still valid token from the disk cache, if any"""
+        try:
+            with open(self._token_cache_path()) as f:
+                cached = json.load(f)
+            if cached.get("expires_at", 0) > time.time():
+                self.token = cached.get("stok")
+        except (OSError, ValueError, AttributeError):
+            pass  # missing or unreadable cache just means logging in again
+    
+    def _save_cached_token(self):
+        """Write the current token to the disk cache"""
+        try:
+            os.makedirs(TOKEN_CACHE_DIR, exist_ok=True)
+            # The token grants camera access, so keep the file private
+            fd = os.open(self._token_cache_path(), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump({"stok": self.token, "expires_at": time.time() + TOKEN_TTL_SECONDS}, f)
+        except OSError as e:
+            print(f"Note: Could not cache auth token: {e}")
+    
+    def _invalidate_token(self):
+        """Forget the current token, in memory and on disk"""
+        self.token = None
+        try:
+            os.remove(self._token_cache_path())
+        except OSError:
+            pass
+    
     def _encrypt_credentials(self):
         """Simple credential encoding for Tapo API"""
         auth_string = f"{self.username}:{self.password}"
@@ -40,10 +200,8 @@ class TapoCamera:
             "method": "login",
             "params": {
                 "hashed": True,
-                "username": base64.b64encode(self.username.encode()).decode(),
-                "password": base64.b64encode(
-                    hashlib.md5(self.password.encode()).hexdigest().encode()
-                ).decode()
+                "username": self._user_b64,
+                "password": self._pw_hashed_b64
             }
         }
         
@@ -53,6 +211,7 @@ class TapoCamera:
                 data = response.json()
                 if data.get("error_code") == 0:
                     self.token = data.get("result", {}).get("stok")
+                    self._save_cached_token()
                     return True
             return False
         except Exception as e:
@@ -61,71 +220,257 @@ class TapoCamera:
     
     def capture_via_rtsp(self, output_path, format_type="PNG"):
         """Capture image using RTSP stream"""
-        # Common RTSP URLs for Tapo cameras
-        rtsp_urls = [
+        fmt = format_type.upper()
+        # Reuse the stream kept open by a previous capture
+        if self.cap is not None:
+            success, message = self.capture_frame_only(output_path, fmt)
+            if success:
+                return success, message
+            print("Stored RTSP stream failed, reconnecting...")
+            self._release_stream()
+        
+        # Prefer a URL that worked before; one pass, so no URL is tried twice
+        rtsp_urls = self._rtsp_urls()
+        if self.rtsp_url in rtsp_urls:
+            rtsp_urls.remove(self.rtsp_url)
+            rtsp_urls.insert(0, self.rtsp_url)
+        winner = self._open_rtsp_urls(rtsp_urls)
+        
+        if winner is None:
+            self.rtsp_url = None
+            return False, "Failed to capture via RTSP"
+        
+        # Keep the stream open for subsequent captures
+        self.rtsp_url, self.cap, frame = winner
+        self._start_reader()
+        return self._store_frame(frame, output_path, fmt)
+    
+    def _rtsp_urls(self):
+        """Common RTSP URLs for Tapo cameras, without duplicates"""
+        return list(dict.fromkeys([
             f"rtsp://{self.username}:{self.password}@{self.ip}:554/stream1",
             f"rtsp://{self.username}:{self.password}@{self.ip}:554/stream2",
             f"rtsp://{self.username}:{quote(self.password)}@{self.ip}:554/stream1"
-        ]
+        ]))
+    
+    def _open_rtsp_urls(self, rtsp_urls):
+        """Open the URLs in parallel and return (url, cap, frame) of the first in list order"""
+        # Earlier URLs are preferred (stream1 is the full resolution main
+        # stream), so a later URL only wins once every earlier one has failed
+        executor = ThreadPoolExecutor(max_workers=len(rtsp_urls))
+        futures = [executor.submit(self._open_and_grab, url) for url in rtsp_urls]
+        winner = None
+        index = 0
         
-        for rtsp_url in rtsp_urls:
-            print(f"Trying RTSP URL: rtsp://{self.username}:***@{self.ip}:554/stream1")
-            
-            cap = cv2.VideoCapture(rtsp_url)
-            
-            # Try to set timeout if supported by OpenCV version
-            try:
-                cap.set(cv2.CAP_PROP_TIMEOUT, 10000)  # 10 second timeout
-            except AttributeError:
-                # Fallback for older OpenCV versions
-                print("Note: Timeout setting not supported in this OpenCV version")
+        try:
+            while index < len(futures) and winner is None:
+                try:
+                    winner = futures[index].result()
+                except Exception as e:
+                    print(f"RTSP attempt failed: {e}")
+                index += 1
+        finally:
+            # Streams not chosen are released as soon as they finish
+            for future in futures[index:]:
+                future.add_done_callback(self._release_unchosen_stream)
+            executor.shutdown(wait=False)
+        
+        return winner
+    
+    @staticmethod
+    def _release_unchosen_stream(future):
+        """Close the stream opened by a URL that was not chosen"""
+        if future.exception() is None and future.result() is not None:
+            future.result()[1].release()
+    
+    def _open_and_grab(self, rtsp_url):
+        """Open one RTSP URL and read a frame, returning (url, cap, frame) or None"""
+        print(f"Trying RTSP URL: rtsp://{self.username}:***@{rtsp_url.rsplit('@', 1)[1]}")
+        
+        # Use FFmpeg directly (no backend probing) with open/read timeouts
+        # so cap.read() blocks for a frame instead of being polled
+        try:
+            cap = cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG, [
+                cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, RTSP_TIMEOUT_MSEC,
+                cv2.CAP_PROP_READ_TIMEOUT_MSEC, RTSP_TIMEOUT_MSEC,
+            ])
+        except (AttributeError, TypeError):
+            # Fallback for OpenCV versions older than 4.5.2
+            print("Note: Timeout setting not supported in this OpenCV version")
+            cap = cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG)
+        
+        if not cap.isOpened():
+            print("Failed to open RTSP connection")
+            cap.release()
+            return None
+        
+        print("RTSP connection established...")
+        frame = self._read_frame(cap)
+        if frame is None:
+            print("Failed to capture valid frame")
+            cap.release()
+            return None
+        
+        return rtsp_url, cap, frame
+    
+    def _start_reader(self):
+        """Start the thread that keeps grabbing from the open stream"""
+        self._frame_request = threading.Event()
+        self._frame_delivered = threading.Event()
+        self._requested_frame = None
+        self._reader_stop = threading.Event()
+        self._reader = threading.Thread(target=self._reader_loop, args=(self.cap,), daemon=True)
+        self._reader.start()
+    
+    def _reader_loop(self, cap):
+        """Grab every frame as it arrives and decode one only when a capture asks"""
+        # Grabbing continuously keeps the stream's queue empty, so the frame
+        # handed over is always one that arrived after the request
+        failures = 0
+        while not self._reader_stop.is_set():
+            if not cap.grab():
+                failures += 1
+                if failures >= RTSP_MAX_GRAB_FAILURES:
+                    print("RTSP stream lost")
+                    break
+                continue
+            failures = 0
             
-            if cap.isOpened():
-                print("RTSP connection established...")
-                
-                # Read a few frames to ensure we get a good one
-                # Add a timeout mechanism for older OpenCV versions
-                start_time = time.time()
-                timeout_seconds = 15
-                
-                for attempt in range(10):  # Try more attempts for reliability
-                    if time.time() - start_time > timeout_seconds:
-                        print("Timeout reached while reading frames")
-                        break
-                        
-                    ret, frame = cap.read()
-                    if ret and frame is not None and frame.size > 0:
-                        print(f"Successfully captured frame (attempt {attempt + 1})")
-                        break
-                    time.sleep(0.2)  # Wait a bit between attempts
-                
-                if ret and frame is not None and frame.size > 0:
-                    # Convert BGR to RGB for PIL
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    
-                    # Save using PIL for better format control
-                    img = Image.fromarray(frame_rgb)
-                    
-                    if format_type.upper() == "PNG":
-                        img.save(output_path, "PNG", optimize=False)
-                    elif format_type.upper() == "TIFF":
-                        img.save(output_path, "TIFF", compression=None)
-                    elif format_type.upper() == "BMP":
-                        img.save(output_path, "BMP")
-                    
-                    cap.release()
-                    return True, f"Image captured via RTSP: {frame.shape[1]}x{frame.shape[0]}"
-                else:
-                    print("Failed to capture valid frame")
+            if self._frame_request.is_set():
+                ret, frame = cap.retrieve()
+                if ret and frame is not None:
+                    self._requested_frame = np.ascontiguousarray(frame)
+                    self._frame_request.clear()
+                    self._frame_delivered.set()
+        
+        # Wake a waiting capture; it finds no frame and reconnects
+        self._frame_delivered.set()
+    
+    def _read_frame(self, cap):
+        """Read frames from an open stream until a valid one arrives, or None"""
+        # Read a few frames to ensure we get a good one
+        # Add a timeout mechanism for older OpenCV versions
+        start_time = time.time()
+        timeout_seconds = 15
+        
+        for attempt in range(10):  # Try more attempts for reliability
+            if time.time() - start_time > timeout_seconds:
+                print("Timeout reached while reading frames")
+                break
                 
-                cap.release()
-            else:
-                print("Failed to open RTSP connection")
+            ret, frame = cap.read()
+            if not ret or frame is None:
+                continue
             
-        return False, "Failed to capture via RTSP"
+            print(f"Successfully captured frame (attempt {attempt + 1})")
+            # OpenCV returns C-contiguous frames; guarantee it once here so the
+            # encoders and PIL's frombuffer can use the buffer as-is
+            return np.ascontiguousarray(frame)
+        
+        return None
+    
+    def capture_frame_only(self, output_path, format_type="PNG"):
+        """Read a frame from the already open RTSP stream and save it"""
+        fmt = format_type.upper()
+        if self._reader is None or not self._reader.is_alive():
+            return False, "RTSP stream is not open"
+        
+        # Ask the reader for the next frame it grabs
+        self._requested_frame = None
+        self._frame_delivered.clear()
+        self._frame_request.set()
+        
+        if not self._frame_delivered.wait(RTSP_FRAME_TIMEOUT_SECONDS) or self._requested_frame is None:
+            self._frame_request.clear()
+            print("Failed to capture valid frame")
+            return False, "Failed to capture valid frame"
+        
+        return self._store_frame(self._requested_frame, output_path, fmt)
     
-    def capture_via_http(self, output_path, format_type="PNG"):
+    def _store_frame(self, frame, output_path, fmt):
+        """Save a captured frame, in the background when a writer is set up"""
+        if self._writer is not None:
+            # Never let two writers touch one file (e.g. a reused --ring-size slot)
+            with self._pending_lock:
+                previous = self._pending_writes.get(output_path)
+            if previous is not None:
+                wait([previous])
+            
+            # Hand the writer its own copy so the capture buffer is never shared
+            self._write_slots.acquire()
+            future = self._writer.submit(self._save_frame, frame.copy(), output_path, fmt)
+            with self._pending_lock:
+                self._pending_writes[output_path] = future
+            future.add_done_callback(lambda done: self._on_save_done(done, output_path))
+            return True, f"Image captured via RTSP: {frame.shape[1]}x{frame.shape[0]} (saving in background)"
+        
+        self._save_frame(frame, output_path, fmt)
+        return True, f"Image captured via RTSP: {frame.shape[1]}x{frame.shape[0]}"
+    
+    def _save_frame(self, frame, output_path, fmt):
+        """Encode a BGR frame with OpenCV (PIL for WebP) and write it to disk"""
+        # OpenCV encodes BGR directly, avoiding the RGB copy and PIL wrapper.
+        # imencode takes the format explicitly, so any output extension works.
+        if fmt not in self._cv_encoders:
+            self._save_frame_pil(frame, output_path, fmt)
+            return
+        extension, params = self._cv_encoders[fmt]
+        try:
+            ok, buffer = cv2.imencode(extension, frame, params)
+        except cv2.error:
+            ok = False  # OpenCV built without this codec
+        
+        if ok:
+            write_image_bytes(output_path, buffer)
+        else:
+            self._save_frame_pil(frame, output_path, fmt)
+    
+    def _save_frame_pil(self, frame, output_path, fmt):
+        """Encode a BGR frame with PIL, swapping channels while unpacking"""
+        # The "BGR" raw decoder reorders channels in C, with no RGB copy in numpy
+        height, width = frame.shape[:2]
+        img = Image.frombuffer("RGB", (width, height), frame.data, "raw", "BGR", 0, 1)
+        self._save_image(img, output_path, fmt)
+    
+    def _save_image(self, img, output_path, fmt):
+        """Save a PIL image in the given upper-case format"""
+        if fmt not in self._pil_savers:
+            raise ValueError(f"Unsupported format: {fmt}")
+        with open_for_overwrite(output_path) as f:
+            self._pil_savers[fmt](img, f)
+            f.truncate()
+    
+    def _on_save_done(self, future, output_path):
+        """Free the writer slot and report failed background saves"""
+        with self._pending_lock:
+            # A newer write to the same path may already be registered
+            if self._pending_writes.get(output_path) is future:
+                del self._pending_writes[output_path]
+        self._write_slots.release()
+        error = future.exception()
+        if error is not None:
+            print(f"Background save failed: {error}")
+    
+    def _release_stream(self):
+        """Stop the reader thread and release the RTSP stream if one is open"""
+        if self._reader is not None:
+            self._reader_stop.set()
+            self._reader.join()  # grab() returns within the read timeout
+            self._reader = None
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+    
+    def close(self):
+        """Release the RTSP stream and wait for pending background saves"""
+        self._release_stream()
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+    
+    def capture_via_http(self, output_path, format_type="PNG", retry_auth=True):
         """Capture image using HTTP API"""
+        fmt = format_type.upper()
         if not self.token and not self._get_auth_token():
             return False, "Authentication failed"
         
@@ -142,45 +487,69 @@ class TapoCamera:
         }
         
         try:
-            response = self.session.post(snapshot_url, json=payload, timeout=15)
-            
-            if response.status_code == 200:
-                # Check if response is JSON (error) or image data
-                content_type = response.headers.get('content-type', '').lower()
+            # Stream so direct image responses go to disk without a full in-memory copy
+            with self.session.post(snapshot_url, json=payload, timeout=15, stream=True) as response:
+                if self._token_rejected(response):
+                    self._invalidate_token()
+                    if retry_auth:
+                        print("Auth token expired, logging in again...")
+                        return self.capture_via_http(output_path, format_type, retry_auth=False)
+                    return False, "Authentication failed"
+                
+                if response.status_code == 200:
+                    # Check if response is JSON (error) or image data
+                    content_type = response.headers.get('content-type', '').lower()
+                    
+                    if 'image' in content_type:
+                        # Direct image response
+                        response.raw.decode_content = True  # honour Content-Encoding
+                        with open_for_overwrite(output_path) as f:
+                            shutil.copyfileobj(response.raw, f, length=64 * 1024)
+                            f.truncate()
+                        return True, "Image captured via HTTP API"
+                    
+                    elif 'application/json' in content_type:
+                        # JSON response might contain base64 image
+                        data = response.json()
+                        if data.get("error_code") == 0:
+                            image_data = data.get("result", {}).get("image", {}).get("snapshot")
+                            if image_data:
+                                # Decode base64 image
+                                image_bytes = base64.b64decode(image_data, validate=True)
+                                
+                                # Already in the requested format: write as-is
+                                if sniff_image_format(image_bytes) == fmt:
+                                    write_image_bytes(output_path, image_bytes)
+                                    return True, "Image captured via HTTP API"
+                                
+                                # Convert to PIL Image for format conversion
+                                img = Image.open(io.BytesIO(image_bytes))
+                                if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+                                    img = img.convert("RGB")  # JPEG has no alpha or palette
+                                
+                                self._save_image(img, output_path, fmt)
+                                
+                                return True, "Image captured via HTTP API"
                 
-                if 'image' in content_type:
-                    # Direct image response
-                    with open(output_path, 'wb') as f:
-                        f.write(response.content)
-                    return True, "Image captured via HTTP API"
+                return False, f"HTTP API failed: {response.status_code}"
                 
-                elif 'application/json' in content_type:
-                    # JSON response might contain base64 image
-                    data = response.json()
-                    if data.get("error_code") == 0:
-                        image_data = data.get("result", {}).get("image", {}).get("snapshot")
-                        if image_data:
-                            # Decode base64 image
-                            image_bytes = base64.b64decode(image_data)
-                            
-                            # Convert to PIL Image for format conversion
-                            img = Image.open(io.BytesIO(image_bytes))
-                            
-                            if format_type.upper() == "PNG":
-                                img.save(output_path, "PNG", optimize=False)
-                            elif format_type.upper() == "TIFF":
-                                img.save(output_path, "TIFF", compression=None)
-                            elif format_type.upper() == "BMP":
-                                img.save(output_path, "BMP")
-                            
-                            return True, "Image captured via HTTP API"
-            
-            return False, f"HTTP API failed: {response.status_code}"
-            
         except Exception as e:
             return False, f"HTTP capture failed: {e}"
 
-def capture_image(ip, username, password, output_path=None, format_type="PNG", method="auto"):
+    @staticmethod
+    def _token_rejected(response):
+        """Whether the camera refused the request because of a stale token"""
+        if response.status_code == 401:
+            return True
+        if 'application/json' in response.headers.get('content-type', '').lower():
+            try:
+                return response.json().get("error_code") == TOKEN_EXPIRED_ERROR_CODE
+            except ValueError:
+                return False
+        return False
+
+def capture_image(ip, username, password, output_path=None, format_type="PNG", method="auto",
+                  png_level=1, camera=None):
     """Main function to capture image from Tapo camera"""
     
     if output_path is None:
@@ -188,34 +557,42 @@ def capture_image(ip, username, password, output_path=None, format_type="PNG", m
         extension = format_type.lower()
         output_path = f"tapo_capture_{ip}_{timestamp}.{extension}"
     
-    camera = TapoCamera(ip, username, password)
+    # Reuse a caller-provided camera (and its open stream) when given
+    owns_camera = camera is None
+    if owns_camera:
+        camera = TapoCamera(ip, username, password, png_level)
     
-    print(f"Capturing image from {ip}...")
-    print(f"Output: {output_path}")
-    print(f"Format: {format_type} (lossless)")
+    try:
+        print(f"Capturing image from {ip}...")
+        print(f"Output: {output_path}")
+        quality = "lossy" if format_type.upper() in LOSSY_FORMATS else "lossless"
+        print(f"Format: {format_type} ({quality})")
     
-    success = False
-    message = ""
+        success = False
+        message = ""
     
-    if method in ["auto", "rtsp"]:
-        print("\nTrying RTSP method...")
-        success, message = camera.capture_via_rtsp(output_path, format_type)
+        if method in ["auto", "rtsp"]:
+            print("\nTrying RTSP method...")
+            success, message = camera.capture_via_rtsp(output_path, format_type)
         
-        if success:
-            print(f"✓ {message}")
-            return output_path
+            if success:
+                print(f"✓ {message}")
+                return output_path
     
-    if not success and method in ["auto", "http"]:
-        print("\nTrying HTTP API method...")
-        success, message = camera.capture_via_http(output_path, format_type)
+        if not success and method in ["auto", "http"]:
+            print("\nTrying HTTP API method...")
+            success, message = camera.capture_via_http(output_path, format_type)
         
-        if success:
-            print(f"✓ {message}")
-            return output_path
+            if success:
+                print(f"✓ {message}")
+                return output_path
     
-    if not success:
-        print(f"✗ Failed to capture image: {message}")
-        return None
+        if not success:
+            print(f"✗ Failed to capture image: {message}")
+            return None
+    finally:
+        if owns_camera:
+            camera.close()
 
 def main():
     parser = argparse.ArgumentParser(description="Capture images from Tapo cameras")
@@ -223,28 +600,49 @@ def main():
     parser.add_argument("username", help="Camera username")
     parser.add_argument("password", help="Camera password")
     parser.add_argument("-o", "--output", help="Output file path")
-    parser.add_argument("-f", "--format", choices=["PNG", "TIFF", "BMP"], 
+    parser.add_argument("-f", "--format", type=str.upper,
+                       choices=["PNG", "TIFF", "BMP", "JPEG", "WEBP"],
                        default="PNG", help="Output format (default: PNG)")
     parser.add_argument("-m", "--method", choices=["auto", "rtsp", "http"],
                        default="auto", help="Capture method (default: auto)")
+    parser.add_argument("--png-level", type=int, choices=range(10), default=1,
+                       metavar="0-9", help="PNG compression level (default: 1)")
     parser.add_argument("--continuous", type=int, metavar="SECONDS",
                        help="Continuous capture every N seconds (Ctrl+C to stop)")
+    parser.add_argument("--ring-size", type=int, metavar="N",
+                       help="With --continuous, cycle through N reused output files")
     
     args = parser.parse_args()
     
+    if args.ring_size is not None:
+        if not args.continuous:
+            parser.error("--ring-size requires --continuous")
+        if args.ring_size < 1:
+            parser.error("--ring-size must be at least 1")
+    
     if args.continuous:
         print(f"Starting continuous capture every {args.continuous} seconds...")
         print("Press Ctrl+C to stop")
         
+        # One camera for the whole session keeps the RTSP stream open between frames
+        camera = TapoCamera(args.ip, args.username, args.password, args.png_level,
+                            background_save=True)
+        
         try:
             counter = 1
             while True:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                output_path = f"tapo_capture_{args.ip}_{timestamp}.{args.format.lower()}"
+                if args.ring_size:
+                    # Fixed set of files overwritten in turn, no new inodes per frame
+                    slot = (counter - 1) % args.ring_size
+                    output_path = f"tapo_capture_{args.ip}_ring{slot:03d}.{args.format.lower()}"
+                else:
+                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    output_path = f"tapo_capture_{args.ip}_{timestamp}.{args.format.lower()}"
                 
                 print(f"\n--- Capture #{counter} ---")
                 result = capture_image(args.ip, args.username, args.password, 
-                                     output_path, args.format, args.method)
+                                     output_path, args.format, args.method,
+                                     args.png_level, camera)
                 
                 if result:
                     print(f"Saved: {result}")
@@ -256,10 +654,13 @@ def main():
                 
         except KeyboardInterrupt:
             print("\nContinuous capture stopped by user")
+        finally:
+            camera.close()
     else:
         # Single capture
         result = capture_image(args.ip, args.username, args.password, 
-                             args.output, args.format, args.method)
+                             args.output, args.format, args.method,
+                             args.png_level)
         
         if result:
             print(f"\n✓ Image saved successfully: {result}")
@@ -287,6 +688,7 @@ if __name__ == "__main__":
         print("  python tapo_capture.py 192.168.1.100 admin password123 -f TIFF -o my_image.tiff")
         print("  python tapo_capture.py 192.168.1.100 admin password123 --continuous 30")
         print("\nLossless formats supported: PNG, TIFF, BMP")
+        print("Lossy formats supported: JPEG, WEBP (faster, smaller files)")
         print("Methods: auto (tries RTSP then HTTP), rtsp, http")
         sys.exit(0)
     